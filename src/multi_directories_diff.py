@@ -1,18 +1,53 @@
 #!/usr/bin/env python3
 import argparse
+import csv
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import hashlib
+from itertools import chain
+import os
 from pathlib import Path
-import pandas as pd
 import re
+import sqlite3
+
+import numpy as np
+
+try:
+    from blake3 import blake3
+except ImportError:  # blake3 未インストール時は hashlib の BLAKE2b で代用
+    blake3 = None
+
+HASH_ALGO = "blake3" if blake3 is not None else "blake2b"
+DEFAULT_HASH_CACHE = Path.home() / ".cache" / "ghg_diff" / "hashes.sqlite"
 
 # ---------- Utility ----------
 
-def sha256sum(path: Path) -> str:
-    h = hashlib.sha256()
-    with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(1 << 20), b""):
-            h.update(chunk)
-    return h.hexdigest()
+# scan_project が basename ごとに返す値
+Entry = namedtuple("Entry", "rel sha collisions")
+
+SMALL_FILE_BYTES = 64 << 10   # これ未満は mmap せず一括読み込み
+THREADED_FILE_BYTES = 1 << 20  # これ以上は BLAKE3 をマルチスレッドで回す
+
+def content_hash(path: str, size: int | None = None) -> str:
+    """
+    内容一致判定用のハッシュを16進文字列で返す。
+    署名用途ではないので SHA-256 ではなく高速な BLAKE3（無ければ BLAKE2b）を使う。
+    size（バイト数）が分かっていれば渡すと stat を省略できる。
+    """
+    if size is None:
+        size = os.stat(path).st_size
+    if blake3 is None:
+        h = hashlib.blake2b(digest_size=32)
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+        return h.hexdigest()
+    if size < SMALL_FILE_BYTES:
+        with open(path, "rb") as f:
+            return blake3(f.read()).hexdigest()
+    # 大きいファイルは mmap して BLAKE3 の木構造並列化に任せる
+    threads = blake3.AUTO if size >= THREADED_FILE_BYTES else 1
+    return blake3(max_threads=threads).update_mmap(path).hexdigest()
 
 def read_paths_file(list_path: Path):
     paths = []
@@ -23,24 +58,139 @@ def read_paths_file(list_path: Path):
         paths.append(line)
     return paths
 
-def scan_project(root_path):
+def walk_files(root: str, suffixes):
+    """
+    root 以下を os.scandir で再帰的にたどり、名前が suffixes で終わるファイルの
+    DirEntry を返すジェネレータ。rglob と同様にシンボリックリンクのディレクトリには入らない。
+    """
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        subdirs = []
+        try:
+            it = os.scandir(d)
+        except PermissionError:  # rglob 同様、読めないディレクトリは飛ばす
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(suffixes) and entry.is_file():
+                    yield entry
+        # rglob と同じ深さ優先・行きがけ順になるよう逆順で積む
+        stack.extend(reversed(subdirs))
+
+def hash_entry(entry: os.DirEntry) -> str:
+    """scandir の DirEntry をハッシュする（サイズは DirEntry のキャッシュを使う）"""
+    return content_hash(entry.path, entry.stat().st_size)
+
+def open_hash_cache(cache_path: Path):
+    """ハッシュキャッシュの sqlite を開く（無ければテーブルごと作る）"""
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(cache_path, timeout=60)  # 複数プロセスからの書き込みはロック待ち
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS hashes (
+            dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,
+            algo TEXT, digest TEXT,
+            PRIMARY KEY (dev, ino)
+        )""")
+    return conn
+
+def cache_key(entry: os.DirEntry):
+    """
+    キャッシュ照合用の (dev, ino, size, mtime_ns) を返す。
+    inode が取れない（Windows の DirEntry は 0）・sqlite の整数に収まらない場合は None。
+    """
+    st = entry.stat()
+    if not st.st_ino or st.st_ino >= 1 << 63 or st.st_dev >= 1 << 63:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def lookup_cached_hashes(conn, keys):
+    """keys の各要素について、キャッシュにあって内容が変わっていなければ digest、なければ None"""
+    digests = []
+    for key in keys:
+        row = None
+        if key is not None:
+            row = conn.execute(
+                "SELECT digest FROM hashes"
+                " WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND algo = ?",
+                key + (HASH_ALGO,)).fetchone()
+        digests.append(row[0] if row else None)
+    return digests
+
+def store_hashes(conn, keys, digests):
+    """計算したハッシュを1回の executemany でキャッシュに書き戻す"""
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+            [key + (HASH_ALGO, digest) for key, digest in zip(keys, digests) if key is not None])
+
+def scan_project(root_path, max_workers=None, cache_path=None):
     """
     root_path 以下の *.py を
-      {basename: {'rel': str, 'sha': str, 'collisions': [str,...]}}
-    で返す
+      {basename: Entry(rel: str, sha: str, collisions: (str,...))}
+    で返す。
+    ハッシュ計算は max_workers 本のスレッドで並列に行う（None で CPU 数、1 で逐次）。
+    cache_path を渡すと、前回から (dev, ino, size, mtime_ns) が変わっていないファイルは
+    sqlite のキャッシュからハッシュを取り、再計算しない。
     """
-    root = Path(root_path).resolve()
+    root = str(Path(root_path).resolve())
+    root_len = len(os.path.join(root, ""))  # entry.path からの rel 切り出し用
     info = {}
-    for p in root.rglob("*.py"):
-        name = p.name
-        rel  = str(p.relative_to(root))
-        sha  = sha256sum(p)
+    collided = {}  # 衝突した basename -> [rel, ...]（最後に tuple にする）
+    targets = []  # 各 basename で最初に見つかったファイル（sha を載せるのはこれだけ）
+    for entry in walk_files(root, ".py"):
+        name = entry.name
+        rel  = entry.path[root_len:]
         if name not in info:
-            info[name] = {"rel": rel, "sha": sha, "collisions": []}
+            info[name] = Entry(rel, None, ())
+            targets.append(entry)
+        elif name in collided:
+            collided[name].append(rel)
         else:
-            if not info[name]["collisions"]:
-                info[name]["collisions"].append(info[name]["rel"])
-            info[name]["collisions"].append(rel)
+            collided[name] = [info[name].rel, rel]
+
+    # キャッシュが開けない・壊れている・ロックされている場合は、キャッシュなしで全件計算する
+    conn = None
+    shas = [None] * len(targets)
+    if cache_path is not None:
+        try:
+            conn = open_hash_cache(cache_path)
+            keys = [cache_key(e) for e in targets]
+            shas = lookup_cached_hashes(conn, keys)
+        except (OSError, sqlite3.Error) as e:
+            print(f"[WARN] ハッシュキャッシュを使わずに計算します: {cache_path} ({e})")
+            if conn is not None:
+                conn.close()
+                conn = None
+    try:
+        misses = [i for i, sha in enumerate(shas) if sha is None]
+        miss_entries = [targets[i] for i in misses]
+
+        # BLAKE3 / hashlib も read も GIL を離すのでスレッドで十分並列になる
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers > 1 and len(miss_entries) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as ex:
+                digests = list(ex.map(hash_entry, miss_entries))
+        else:
+            digests = [hash_entry(e) for e in miss_entries]
+        for i, digest in zip(misses, digests):
+            shas[i] = digest
+
+        if conn is not None:
+            try:
+                store_hashes(conn, [keys[i] for i in misses], digests)
+            except (OSError, sqlite3.Error) as e:
+                print(f"[WARN] ハッシュキャッシュに書き込めませんでした: {cache_path} ({e})")
+    finally:
+        if conn is not None:
+            conn.close()
+
+    for entry, sha in zip(targets, shas):
+        name = entry.name
+        info[name] = info[name]._replace(sha=sha, collisions=tuple(collided.get(name, ())))
     return info
 
 def decide_status(flags, names):
@@ -52,12 +202,65 @@ def decide_status(flags, names):
     present = [n for n, f in zip(names, flags) if f]
     return "_".join(present)
 
+def exists_masks(exists):
+    """(n_keys, n_projects) の bool 配列を、列 i をビット i とする整数マスクのリストにする"""
+    n_proj = exists.shape[1]
+    if n_proj <= 62:
+        return (exists @ (1 << np.arange(n_proj, dtype=np.int64))).tolist()
+    packed = np.packbits(exists, axis=1, bitorder="little")
+    return [int.from_bytes(row.tobytes(), "little") for row in packed]
+
+def decide_statuses(exists, names):
+    """
+    exists: (n_keys, n_projects) の bool 配列から行ごとの status のリストを返す。
+    status は実際に現れたマスクの分だけ計算し、{マスク: status} の表で使い回す。
+    """
+    n = len(names)
+    table = {}
+    statuses = []
+    for mask in exists_masks(exists):
+        status = table.get(mask)
+        if status is None:
+            status = table[mask] = decide_status([(mask >> i) & 1 for i in range(n)], names)
+        statuses.append(status)
+    return statuses
+
+GROUP_BLOCK_CELLS = 1 << 22  # assign_groups の比較テンソル1ブロックあたりの要素数の上限
+
+def assign_groups(codes):
+    """
+    codes: (n_keys, n_projects) の int 配列（sha を整数化したもの、存在しないセルは -1）。
+    行ごとに左の列から初出の sha 順に 1, 2, ... とグループ番号を振り、
+    (グループ番号の配列（存在しないセルは 0）, 行ごとのグループ数) を返す。
+    """
+    n_keys, n_proj = codes.shape
+    gids = np.zeros(codes.shape, dtype=np.int64)
+    num_groups = np.zeros(n_keys, dtype=np.int64)
+    if n_keys == 0 or n_proj == 0:
+        return gids, num_groups
+    cols = np.arange(n_proj)
+    # 比較テンソルは行あたり n_proj**2 要素になるので、行をブロックに分けてメモリを抑える
+    block = max(1, GROUP_BLOCK_CELLS // (n_proj * n_proj))
+    for lo in range(0, n_keys, block):
+        c = codes[lo:lo + block]
+        exists = c >= 0
+        # match[k, j, l]: 行 k で列 j と列 l（存在するもの）が同じ sha
+        match = (c[:, :, None] == c[:, None, :]) & exists[:, None, :]
+        first = match.argmax(axis=2)  # 同じ sha が最初に現れる列
+        del match
+        is_first = exists & (first == cols)
+        rank = np.cumsum(is_first, axis=1)  # 初出の列に振られるグループ番号
+        gids[lo:lo + block] = np.where(exists, np.take_along_axis(rank, first, axis=1), 0)
+        num_groups[lo:lo + block] = is_first.sum(axis=1)
+    return gids, num_groups
+
+_SLUG_RE = re.compile(r"[^0-9A-Za-z_]+")
+
 def slugify(text: str) -> str:
     """
     CSV列名にしても困らないように、英数字と '_' のみにする簡易版。
     """
-    text = re.sub(r"[^0-9A-Za-z_]+", "_", text)
-    return text.strip("_") or "proj"
+    return _SLUG_RE.sub("_", text).strip("_") or "proj"
 
 def short_name(p: Path, keep_parts=2) -> str:
     """
@@ -78,6 +281,16 @@ def make_unique(names):
             result.append(f"{n}_{seen[n]}")
     return result
 
+def write_csv(out_path: Path, columns: dict) -> int:
+    """列ごとのリスト {列名: [...]} を CSV に書き出し、書いた行数を返す"""
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with out_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(columns.keys())
+        rows = list(zip(*columns.values()))
+        writer.writerows(rows)
+    return len(rows)
+
 # ---------- Main ----------
 
 def main():
@@ -90,6 +303,10 @@ def main():
                         help="パス一覧を1行1パスで記述したテキストファイル")
     parser.add_argument("--out", default=str(Path.cwd() / "multi_projects_diff.csv"),
                         help="出力CSVパス（デフォルト: カレントディレクトリ）")
+    parser.add_argument("--hash-cache", type=Path, default=DEFAULT_HASH_CACHE,
+                        help=f"ハッシュキャッシュ（sqlite）の保存先（デフォルト: {DEFAULT_HASH_CACHE}）")
+    parser.add_argument("--no-hash-cache", action="store_true",
+                        help="ハッシュキャッシュを使わず全ファイルを再計算する")
     parser.add_argument("--debug", action="store_true",
                         help="読み込んだパス等を表示してデバッグ用に使う")
     args = parser.parse_args()
@@ -130,82 +347,105 @@ def main():
     raw_names = [short_name(p, keep_parts=2) for p in project_paths]
     names     = make_unique(raw_names)  # 重複があれば _2, _3…
 
-    # 元の順番を覚えておく（group_summary の並び用）
-    order = {name: i for i, name in enumerate(names)}
-
     # ---- 走査 ----
-    index_list = [scan_project(p) for p in project_paths]
-
-    # ---- 全ファイル名集合 ----
-    all_keys = set().union(*[idx.keys() for idx in index_list])
-
-    # ---- 行データ作成 ----
-    rows = []
-    for key in sorted(all_keys):
-        row = {"ファイル名": key}
-        exists_flags = []
-
-        sha_to_gid = {}
-        next_gid   = 1
-        group_assignments = [None] * len(names)
-
-        for i, name in enumerate(names):
-            d = index_list[i].get(key)
-            exists = d is not None
-            exists_flags.append(exists)
-
-            if exists:
-                sha = d["sha"]
-                if sha not in sha_to_gid:
-                    sha_to_gid[sha] = next_gid
-                    next_gid += 1
-                gid = sha_to_gid[sha]
-                group_assignments[i] = gid
-
-                row[f"path_{name}"]      = d["rel"]
-                row[f"sha_{name}"]       = sha[:12]
-                row[f"collision_{name}"] = ",".join(d["collisions"]) if d["collisions"] else None
+    # プロジェクト単位でプロセス並列にし、コアが余る場合だけ各プロセス内でもスレッドでハッシュする
+    cache_path = None if args.no_hash_cache else args.hash_cache
+    if cache_path is not None:
+        # 開けないキャッシュはプロセスごとに警告が出ないよう、ここで一度だけ確かめて外す
+        try:
+            open_hash_cache(cache_path).close()
+        except (OSError, sqlite3.Error) as e:
+            print(f"[WARN] ハッシュキャッシュを使わずに計算します: {cache_path} ({e})")
+            cache_path = None
+    cpus = os.cpu_count() or 1
+    n_procs = min(len(project_paths), cpus)
+    n_threads = max(1, cpus // max(1, len(project_paths)))
+    if n_procs > 1:
+        with ProcessPoolExecutor(max_workers=n_procs) as ex:
+            index_list = list(ex.map(scan_project, project_paths,
+                                     [n_threads] * len(project_paths),
+                                     [cache_path] * len(project_paths)))
+    else:
+        index_list = [scan_project(p, n_threads, cache_path) for p in project_paths]
+
+    # ---- 全ファイル名集合（中間の set を作らず1パスで集める） ----
+    all_keys = dict.fromkeys(chain.from_iterable(index_list))
+
+    # ---- 列データ作成（行 dict ではなく列ごとのリストに積む） ----
+    header = ["ファイル名"]
+    for name in names:
+        header += [f"path_{name}", f"sha_{name}", f"collision_{name}", f"exists_{name}"]
+    header += ["status"] + [f"group_{name}" for name in names] + ["group_summary", "num_groups"]
+    columns = {c: [] for c in header}
+
+    keys = sorted(all_keys)
+    columns["ファイル名"] = keys
+
+    # プロジェクトごとに path/sha/collision 列を埋めつつ、sha を整数コードにした列を作る
+    sha_ids = {}
+    code_cols = []
+    for name, idx in zip(names, index_list):
+        path_col      = columns[f"path_{name}"]
+        sha_col       = columns[f"sha_{name}"]
+        collision_col = columns[f"collision_{name}"]
+        codes = []
+        for key in keys:
+            d = idx.get(key)
+            if d is None:
+                path_col.append(None)
+                sha_col.append(None)
+                collision_col.append(None)
+                codes.append(-1)
             else:
-                row[f"path_{name}"]      = None
-                row[f"sha_{name}"]       = None
-                row[f"collision_{name}"] = None
-
-            row[f"exists_{name}"] = exists
-
-        # status
-        row["status"] = decide_status(exists_flags, names)
-
-        # group columns
-        for name, gid in zip(names, group_assignments):
-            row[f"group_{name}"] = gid
-
-        # group_summary
-        gid_to_projects = {}
-        for proj_name, gid in zip(names, group_assignments):
-            if gid is None:
-                continue
-            gid_to_projects.setdefault(gid, []).append(proj_name)
-
-        row["group_summary"] = ";".join(
-            f"G{gid}:{','.join(sorted(gid_to_projects[gid], key=lambda x: order[x]))}"
-            for gid in sorted(gid_to_projects)
-        )
-        row["num_groups"] = len(gid_to_projects)
-
-        rows.append(row)
+                path_col.append(d.rel)
+                sha_col.append(d.sha[:12])
+                collision_col.append(",".join(d.collisions) if d.collisions else None)
+                codes.append(sha_ids.setdefault(d.sha, len(sha_ids)))
+        code_cols.append(codes)
+
+    # (n_keys, n_projects) 行列にして status / グループ番号をまとめて計算
+    codes = np.array(code_cols, dtype=np.int64).reshape(len(names), len(keys)).T
+    exists = codes >= 0
+    gids, num_groups = assign_groups(codes)
+
+    for name, col in zip(names, exists.T.tolist()):
+        columns[f"exists_{name}"] = col
+    columns["status"] = decide_statuses(exists, names)
+    for name, col in zip(names, gids.T.tolist()):
+        columns[f"group_{name}"] = [gid or None for gid in col]
+
+    # group_summary（グループ番号の並びが同じ行は同じ文字列になるので使い回す）
+    summary_col = columns["group_summary"]
+    summary_table = {}
+    for group_assignments in gids.tolist():
+        sig = tuple(group_assignments)
+        summary = summary_table.get(sig)
+        if summary is None:
+            gid_to_projects = {}
+            for proj_name, gid in zip(names, group_assignments):
+                if not gid:
+                    continue
+                gid_to_projects.setdefault(gid, []).append(proj_name)
+
+            # names の順に回しているので各グループ内は元の順、gid も初出順に 1, 2, ... と
+            # 振られているので dict の挿入順がそのまま gid 昇順（どちらも並べ替え不要）
+            summary = summary_table[sig] = ";".join(
+                f"G{gid}:{','.join(projects)}" for gid, projects in gid_to_projects.items()
+            )
+        summary_col.append(summary)
+    columns["num_groups"] = num_groups.tolist()
 
     # ---- CSV 出力 ----
-    df = pd.DataFrame(rows)
     out_path = Path(args.out)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(out_path, index=False)
-    print(f"Wrote {out_path} ({len(df)} rows).")
+    n_rows = write_csv(out_path, columns)
+    print(f"Wrote {out_path} ({n_rows} rows).")
 
     # ---- デバッグ表示 ----
     if args.debug:
-        diff_df = df[df["num_groups"] > 1][["ファイル名", "group_summary"]]
         print("\n[DEBUG] 内容が異なるファイル抜粋:")
-        print(diff_df.to_string(index=False))
+        for key, summary, n_groups in zip(keys, summary_col, columns["num_groups"]):
+            if n_groups > 1:
+                print(f"  {key}\t{summary}")
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 import argparse
+import csv
+from collections import namedtuple
+from itertools import chain
 from pathlib import Path
-import pandas as pd
+import os
+
+# scan_project が basename ごとに返す値
+Entry = namedtuple("Entry", "rel collisions")
 
 def read_paths_file(list_path: Path):
     """--list で指定されたファイルからパスを読み込む。
@@ -14,20 +20,48 @@ def read_paths_file(list_path: Path):
         paths.append(line)
     return paths
 
+def walk_files(root: str, suffixes):
+    """
+    root 以下を os.scandir で再帰的にたどり、名前が suffixes で終わるファイルの
+    DirEntry を返すジェネレータ。rglob と同様にシンボリックリンクのディレクトリには入らない。
+    """
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        subdirs = []
+        try:
+            it = os.scandir(d)
+        except PermissionError:  # rglob 同様、読めないディレクトリは飛ばす
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(suffixes) and entry.is_file():
+                    yield entry
+        # rglob と同じ深さ優先・行きがけ順になるよう逆順で積む
+        stack.extend(reversed(subdirs))
+
 def scan_project(root_path):
-    """root_path 以下の *.py を {basename: {'rel': str, 'collisions': [str,...]}} 形式で返す"""
-    root = Path(root_path).resolve()
+    """root_path 以下の *.py を {basename: Entry(rel: str, collisions: (str,...))} 形式で返す"""
+    root = os.fspath(root_path)
+    if not os.path.isdir(root):
+        return {}
+    root_len = len(os.path.join(root, ""))  # entry.path からの rel 切り出し用
     info = {}
-    for p in root.rglob("*.py"):
-        name = p.name
-        rel = str(p.relative_to(root))
+    collided = {}  # 衝突した basename -> [rel, ...]（最後に tuple にする）
+    for entry in walk_files(root, ".py"):
+        name = entry.name
+        rel = entry.path[root_len:]
         if name not in info:
-            info[name] = {"rel": rel, "collisions": []}
+            info[name] = Entry(rel, ())
+        elif name in collided:
+            collided[name].append(rel)
         else:
             # 既にある → 衝突として記録
-            if not info[name]["collisions"]:
-                info[name]["collisions"].append(info[name]["rel"])
-            info[name]["collisions"].append(rel)
+            collided[name] = [info[name].rel, rel]
+    for name, rels in collided.items():
+        info[name] = info[name]._replace(collisions=tuple(rels))
     return info
 
 def decide_status(flags):
@@ -44,6 +78,16 @@ def decide_status(flags):
     present = [f"p{i+1}" for i, f in enumerate(flags) if f]
     return "_".join(present)
 
+def write_csv(out_path: Path, columns: dict) -> int:
+    """列ごとのリスト {列名: [...]} を CSV に書き出し、書いた行数を返す"""
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with out_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(columns.keys())
+        rows = list(zip(*columns.values()))
+        writer.writerows(rows)
+    return len(rows)
+
 def main():
     parser = argparse.ArgumentParser(
         description="複数プロジェクト間の *.py ファイル存在差分を一覧化（内容までは見ない簡易版）"
@@ -107,33 +151,39 @@ def main():
     # ---- 各プロジェクトを走査 ----
     index_list = [scan_project(p) for p in project_paths]
 
-    # ---- 全てのファイル名キーを集約 ----
-    all_keys = set()
-    for idx in index_list:
-        all_keys.update(idx.keys())
+    # ---- 全てのファイル名キーを集約（中間の set を作らず1パスで集める） ----
+    all_keys = dict.fromkeys(chain.from_iterable(index_list))
+
+    # ---- 列データを作成（行 dict ではなく列ごとのリストに積む） ----
+    header = ["ファイル名"]
+    for name in names:
+        header += [f"exists_{name}", f"path_{name}", f"collision_{name}"]
+    header.append("status")
+    columns = {c: [] for c in header}
+
+    key_col = columns["ファイル名"]
+    exists_cols = [columns[f"exists_{name}"] for name in names]
+    path_cols = [columns[f"path_{name}"] for name in names]
+    collision_cols = [columns[f"collision_{name}"] for name in names]
+    status_col = columns["status"]
 
-    # ---- 行データを作成 ----
-    rows = []
     for key in sorted(all_keys):
-        row = {"ファイル名": key}
+        key_col.append(key)
         exists_flags = []
-        for i, name in enumerate(names):
+        for i in range(len(names)):
             d = index_list[i].get(key)
             exists = d is not None
-            row[f"exists_{name}"] = exists
-            row[f"path_{name}"] = d["rel"] if exists else None
-            row[f"collision_{name}"] = ",".join(d["collisions"]) if exists and d["collisions"] else None
+            exists_cols[i].append(exists)
+            path_cols[i].append(d.rel if exists else None)
+            collision_cols[i].append(",".join(d.collisions) if exists and d.collisions else None)
             exists_flags.append(exists)
 
-        row["status"] = decide_status(exists_flags)
-        rows.append(row)
+        status_col.append(decide_status(exists_flags))
 
     # ---- CSV 出力 ----
-    df = pd.DataFrame(rows)
     out_path = Path(args.out)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(out_path, index=False)
-    print(f"Wrote {out_path} ({len(df)} rows).")
+    n_rows = write_csv(out_path, columns)
+    print(f"Wrote {out_path} ({n_rows} rows).")
 
 if __name__ == "__main__":
     main()
@@ -1,42 +1,132 @@
 #!/usr/bin/env python3
 import argparse
+from collections import namedtuple
+import csv
 from pathlib import Path
-import hashlib
+import os
+import io
 import difflib
-import pandas as pd
+import shutil
+import subprocess
 
 # ---------- Utility ----------
 
-def read_text_lines(path: Path):
-    with path.open("r", encoding="utf-8", errors="replace") as f:
-        return f.readlines()
+# scan_project が basename ごとに返す値
+Entry = namedtuple("Entry", "rel abs collisions size")
 
-def sha256sum(path: Path) -> str:
-    h = hashlib.sha256()
-    with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(1 << 20), b""):
-            h.update(chunk)
-    return h.hexdigest()
+def decode_text_lines(data: bytes):
+    """
+    読み込み済みのバイト列を、テキストモードで readlines() したのと同じ行リストにする。
+    decode は全体で1回だけ行い、改行は \r\n / \r を \n に揃えてから \n でだけ区切る
+    （str.splitlines は \x0c なども区切ってしまうので使わない）。
+    """
+    text = data.decode("utf-8", errors="replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return io.StringIO(text).readlines()
+
+GIT = shutil.which("git")
+GIT_DIFF_MIN_BYTES = 64 << 10  # これ以上のファイルは difflib ではなく git diff で差分を取る
+
+# 実行する人の ~/.gitconfig やシステム設定で出力が変わらないよう、設定は読ませず既定値を明示する
+GIT_ENV = {k: v for k, v in os.environ.items()
+           if k not in ("GIT_DIFF_OPTS", "GIT_CONFIG_PARAMETERS", "GIT_CONFIG_COUNT")}
+GIT_ENV.update(GIT_CONFIG_NOSYSTEM="1", GIT_CONFIG_GLOBAL=os.devnull)
+GIT_CONFIG_ARGS = ["-c", "core.quotePath=false", "-c", "diff.algorithm=myers",
+                   "-c", "diff.suppressBlankEmpty=false", "-c", "diff.interHunkContext=0"]
+# 本文として許す行の先頭（ヘッダ以降にこれ以外が来たら git の出力は使わない）
+GIT_HUNK_PREFIXES = ("@@", " ", "+", "-", "\\")
+
+def git_unified_diff(path1: Path, path2: Path):
+    """
+    git diff --no-index で unified diff を取り、difflib.unified_diff(..., lineterm="") と
+    同じ形（ヘッダ・@@ 行は改行なし、本文の行は改行付き）の行リストで返す。
+    git が無い・失敗した・想定外の出力だった場合は None（呼び出し側で difflib にフォールバックする）。
+    """
+    if GIT is None:
+        return None
+    # シンボリックリンクのままだとリンク先のパス文字列同士の diff になるので実体を渡す
+    cmd = [GIT, *GIT_CONFIG_ARGS, "diff", "--no-index", "--no-color", "--no-ext-diff",
+           "--no-textconv", "--text", "-U3", "--",
+           os.path.realpath(path1), os.path.realpath(path2)]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, env=GIT_ENV)
+    except OSError:
+        return None
+    if proc.returncode not in (0, 1):  # 0: 差分なし, 1: 差分あり, それ以外はエラー
+        return None
+    # text=True だと単独の \r でも行が割れるので、バイトで受けて "\n" でだけ区切る
+    lines = io.StringIO(proc.stdout.decode("utf-8", errors="replace")).readlines()
+    if sum(line.startswith("diff --git ") for line in lines) != 1:
+        return None
+    # "diff --git ..." / "index ..." / "--- a/..." / "+++ b/..." は difflib 形式のヘッダに置き換える
+    start = next((i for i, line in enumerate(lines) if line.startswith("@@")), None)
+    if start is None:
+        return None
+    diff_lines = [f"--- {path1}", f"+++ {path2}"]
+    for line in lines[start:]:
+        if not line.startswith(GIT_HUNK_PREFIXES):
+            return None
+        # 改行は decode_text_lines と同じく \r\n を \n に揃える。単独の \r は difflib 側では
+        # 行の区切りになり git とは行の数え方が合わないので、difflib に任せる
+        if "\r" in line:
+            line = line.replace("\r\n", "\n")
+            if "\r" in line:
+                return None
+        if line.startswith("@@"):
+            # 末尾の関数名コンテキストは difflib に無いので "@@ -a,b +c,d @@" までにする
+            diff_lines.append(line[:line.index(" @@", 2) + 3])
+        elif line.startswith("\\"):
+            # "\ No newline at end of file" は出さず、difflib と同じく直前の行の改行を落とす
+            diff_lines[-1] = diff_lines[-1].removesuffix("\n")
+        else:
+            diff_lines.append(line)
+    return diff_lines
+
+def walk_files(root: str, suffixes):
+    """
+    root 以下を os.scandir で再帰的にたどり、名前が suffixes で終わるファイルの
+    DirEntry を返すジェネレータ。rglob と同様にシンボリックリンクのディレクトリには入らない。
+    """
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        subdirs = []
+        try:
+            it = os.scandir(d)
+        except PermissionError:  # rglob 同様、読めないディレクトリは飛ばす
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(suffixes) and entry.is_file():
+                    yield entry
+        # rglob と同じ深さ優先・行きがけ順になるよう逆順で積む
+        stack.extend(reversed(subdirs))
 
 def scan_project(root_path: Path, patterns):
     """
     root_path 以下の指定拡張子ファイルを
-    {basename: {'rel': str, 'abs': str, 'collisions': [str,...]}} で返す
+    {basename: Entry(rel: str, abs: str, collisions: (str,...), size: int)} で返す
     """
-    root = root_path.resolve()
+    root = str(root_path.resolve())
+    root_len = len(os.path.join(root, ""))  # entry.path からの rel 切り出し用
     info = {}
-    for pat in patterns:
-        for p in root.rglob(f"*{pat}"):
-            name = p.name
-            rel = str(p.relative_to(root))
-            abs_ = str(p)
-            if name not in info:
-                info[name] = {"rel": rel, "abs": abs_, "collisions": []}
-            else:
-                # 衝突
-                if not info[name]["collisions"]:
-                    info[name]["collisions"].append(info[name]["rel"])
-                info[name]["collisions"].append(rel)
+    collided = {}  # 衝突した basename -> [rel, ...]（最後に tuple にする）
+    for entry in walk_files(root, tuple(patterns)):
+        name = entry.name
+        rel = entry.path[root_len:]
+        abs_ = entry.path
+        if name not in info:
+            info[name] = Entry(rel, abs_, (), entry.stat().st_size)
+        elif name in collided:
+            collided[name].append(rel)
+        else:
+            # 衝突
+            collided[name] = [info[name].rel, rel]
+    for name, rels in collided.items():
+        info[name] = info[name]._replace(collisions=tuple(rels))
     return info
 
 def decide_status(p1_exists: bool, p2_exists: bool, same: bool | None):
@@ -64,6 +154,16 @@ def write_diff_file(diff_text: str, out_dir: Path, key: str):
     diff_path.write_text(diff_text, encoding="utf-8")
     return str(diff_path)
 
+def write_csv(out_path: Path, columns: dict) -> int:
+    """列ごとのリスト {列名: [...]} を CSV に書き出し、書いた行数を返す"""
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with out_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(columns.keys())
+        rows = list(zip(*columns.values()))
+        writer.writerows(rows)
+    return len(rows)
+
 # ---------- Main ----------
 
 def main():
@@ -97,8 +197,13 @@ def main():
     idx1 = scan_project(p1, patterns)
     idx2 = scan_project(p2, patterns)
 
-    all_keys = sorted(set(idx1.keys()) | set(idx2.keys()))
-    rows = []
+    all_keys = sorted(idx1.keys() | idx2.keys())  # dict_keys 同士の | で直接 set になる
+
+    # 行 dict ではなく列ごとのリストに積む
+    header = ["key", "exists_p1", "path_p1", "collision_p1",
+              "exists_p2", "path_p2", "collision_p2",
+              "same", "status", "diff_file", "diff_text"]
+    columns = {c: [] for c in header}
 
     diff_dir = Path(args.diff_dir) if args.diff_dir else None
 
@@ -114,22 +219,38 @@ def main():
 
         if p1_exists and p2_exists:
             # 比較対象となるファイルを1つに決める（衝突時は最初の rel を使う）
-            path1 = Path(p1 / d1["rel"])
-            path2 = Path(p2 / d2["rel"])
+            path1 = Path(p1 / d1.rel)
+            path2 = Path(p2 / d2.rel)
 
-            # まずハッシュで高速一致判定
-            same = sha256sum(path1) == sha256sum(path2)
+            # 各ファイルは一度だけ読み、そのバイト列を一致判定にも diff にも使う。
+            # サイズが違えば中身の比較はせず、git diff を使う大きいファイルはここでは読まない
+            # （git が自分で読むので、difflib にフォールバックしたときだけ読む）
+            data1 = data2 = None
+            if d1.size == d2.size:
+                data1 = path1.read_bytes()
+                data2 = path2.read_bytes()
+                same = data1 == data2
+            else:
+                same = False
             if not same:
-                lines1 = read_text_lines(path1)
-                lines2 = read_text_lines(path2)
-                diff_iter = difflib.unified_diff(
-                    lines1, lines2,
-                    fromfile=str(path1),
-                    tofile=str(path2),
-                    lineterm=""
-                )
-                # テキスト化
-                diff_lines = list(diff_iter)
+                # 大きいファイルは純 Python の difflib だと遅いので git diff に任せる
+                diff_lines = None
+                if max(d1.size, d2.size) >= GIT_DIFF_MIN_BYTES:
+                    diff_lines = git_unified_diff(path1, path2)
+                if diff_lines is None:
+                    if data1 is None:
+                        data1 = path1.read_bytes()
+                        data2 = path2.read_bytes()
+                    lines1 = decode_text_lines(data1)
+                    lines2 = decode_text_lines(data2)
+                    diff_iter = difflib.unified_diff(
+                        lines1, lines2,
+                        fromfile=str(path1),
+                        tofile=str(path2),
+                        lineterm=""
+                    )
+                    # テキスト化
+                    diff_lines = list(diff_iter)
                 if args.max_diff_lines and len(diff_lines) > args.max_diff_lines:
                     trunk = diff_lines[:args.max_diff_lines]
                     trunk.append(f"...(truncated {len(diff_lines)-args.max_diff_lines} lines)...")
@@ -141,26 +262,21 @@ def main():
                 if diff_dir:
                     diff_file_path = write_diff_file(diff_text, diff_dir, key)
 
-        row = {
-            "key": key,
-            "exists_p1": p1_exists,
-            "path_p1": d1["rel"] if p1_exists else None,
-            "collision_p1": ",".join(d1["collisions"]) if (p1_exists and d1["collisions"]) else None,
-            "exists_p2": p2_exists,
-            "path_p2": d2["rel"] if p2_exists else None,
-            "collision_p2": ",".join(d2["collisions"]) if (p2_exists and d2["collisions"]) else None,
-            "same": same if same is not None else None,
-            "status": decide_status(p1_exists, p2_exists, same),
-            "diff_file": diff_file_path,
-            "diff_text": diff_text
-        }
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
+        columns["key"].append(key)
+        columns["exists_p1"].append(p1_exists)
+        columns["path_p1"].append(d1.rel if p1_exists else None)
+        columns["collision_p1"].append(",".join(d1.collisions) if (p1_exists and d1.collisions) else None)
+        columns["exists_p2"].append(p2_exists)
+        columns["path_p2"].append(d2.rel if p2_exists else None)
+        columns["collision_p2"].append(",".join(d2.collisions) if (p2_exists and d2.collisions) else None)
+        columns["same"].append(same)
+        columns["status"].append(decide_status(p1_exists, p2_exists, same))
+        columns["diff_file"].append(diff_file_path)
+        columns["diff_text"].append(diff_text)
+
     out_path = Path(args.out)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(out_path, index=False)
-    print(f"Wrote {out_path} ({len(df)} rows).")
+    n_rows = write_csv(out_path, columns)
+    print(f"Wrote {out_path} ({n_rows} rows).")
 
 if __name__ == "__main__":
     main()